@@ -1,10 +1,16 @@
+import hashlib
 import os
 import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
 from typing import Optional
 from dotenv import load_dotenv
 from langchain_openai import ChatOpenAI
-from langchain.chains import ConversationChain
-from langchain.memory import ConversationSummaryMemory
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.output_parsers import StrOutputParser
+from langchain.memory import ConversationSummaryBufferMemory
 
 try:
     from rebuff import Rebuff
@@ -12,6 +18,18 @@ try:
 except Exception:
     REBUFF_AVAILABLE = False
 
+try:
+    import hyperscan
+    HYPERSCAN_AVAILABLE = True
+except Exception:
+    HYPERSCAN_AVAILABLE = False
+
+try:
+    import ahocorasick
+    AHOCORASICK_AVAILABLE = True
+except Exception:
+    AHOCORASICK_AVAILABLE = False
+
 
 def build_llm() -> ChatOpenAI:
     load_dotenv()
@@ -23,10 +41,41 @@ def build_llm() -> ChatOpenAI:
         temperature=0,
         openai_api_key=groq_key,
         openai_api_base="https://api.groq.com/openai/v1",
+        # tiktoken knows no Llama names; memory pruning needs a countable encoding
+        tiktoken_model_name="gpt-3.5-turbo",
     )
 
 
-# 2) Simple rule-based guardrail (heuristic fallback)
+# Letters re.IGNORECASE matches to ASCII that NFKD + casefold leave alone
+_SRE_CASE_EQUIVALENTS = {"\u0131": "i"}  # dotless i
+_SRE_CASE_TABLE = str.maketrans(_SRE_CASE_EQUIVALENTS)
+assert all(re.fullmatch(a, c, re.IGNORECASE) for c, a in _SRE_CASE_EQUIVALENTS.items())
+
+
+def fold_text(text: str) -> str:
+    if text.isascii():
+        return text.lower()
+    # NFKD + dropping combining marks maps look-alikes (long s, dotted I, fullwidth) onto ASCII
+    decomposed = unicodedata.normalize("NFKD", text)
+    folded = "".join(ch for ch in decomposed if not unicodedata.combining(ch)).casefold()
+    return folded.translate(_SRE_CASE_TABLE)
+
+
+# Normalized forms of one user turn, computed once and shared by every guardrail check
+@dataclass(frozen=True)
+class Query:
+    raw: str
+    folded: str
+    folded_bytes: bytes
+
+    @classmethod
+    def from_text(cls, text: str) -> "Query":
+        folded = fold_text(text)
+        return cls(raw=text, folded=folded, folded_bytes=folded.encode("utf-8", "replace"))
+
+
+# 2) Simple rule-based guardrail (checked before Rebuff)
+# Written in lowercase: they are matched case-sensitively against Query.folded_bytes
 SUSPECT_PATTERNS = [
     r"ignore (all|the) (previous|prior) instructions",
     r"disregard (all|the) (previous|prior) instructions",
@@ -36,27 +85,75 @@ SUSPECT_PATTERNS = [
     r"bypass.*(safety|guard|restriction)",
     r"act as .*developer mode",
     r"please leak",
-    r"BEGIN SYSTEM PROMPT",
+    r"begin system prompt",
     r"prompt injection",
     r"exfiltrate",
     r"api[_\- ]?key",
     r"password",
-    r"DROP TABLE",
+    r"drop table",
     r"share.*prompt",
     r"show.*prompt",
 ]
 
-COMPILED_PATTERNS = [re.compile(pat, re.IGNORECASE) for pat in SUSPECT_PATTERNS]
+# All patterns are ASCII; matching on bytes keeps the scan off the Unicode code paths
+PATTERN_BYTES = [pat.encode() for pat in SUSPECT_PATTERNS]
 
+# All patterns folded into one alternation so each input is scanned in a single pass
+ADVERSARIAL_RE = re.compile(b"|".join(b"(?:" + pat + b")" for pat in PATTERN_BYTES))
 
-def heuristic_is_adversarial(user_input: str) -> bool:
-    for pat in COMPILED_PATTERNS:
-        if pat.search(user_input):
-            return True
-    return False
+
+# Hyperscan block-mode database (SIMD multi-pattern scan); falls back to ADVERSARIAL_RE
+HS_DATABASE = None
+if HYPERSCAN_AVAILABLE:
+    try:
+        HS_DATABASE = hyperscan.Database()
+        HS_DATABASE.compile(
+            expressions=PATTERN_BYTES,
+            ids=list(range(len(PATTERN_BYTES))),
+            flags=[hyperscan.HS_FLAG_SINGLEMATCH] * len(PATTERN_BYTES),
+        )
+    except Exception:
+        HS_DATABASE = None
+
+# Hyperscan scratch space must not be shared between threads
+_hs_local = threading.local()
+
+
+def _hs_scratch():
+    scratch = getattr(_hs_local, "scratch", None)
+    if scratch is None:
+        scratch = hyperscan.Scratch(HS_DATABASE)
+        _hs_local.scratch = scratch
+    return scratch
+
+
+def _hs_on_match(pat_id, start, end, flags, context):
+    # Returning True stops the scan at the first hit
+    context[0] = True
+    return True
+
+
+def heuristic_is_adversarial(q: Query) -> bool:
+    data = q.folded_bytes
+    if HS_DATABASE is not None:
+        hit = [False]
+        try:
+            HS_DATABASE.scan(
+                data,
+                match_event_handler=_hs_on_match,
+                context=hit,
+                scratch=_hs_scratch(),
+            )
+        except hyperscan.ScanTerminated:
+            pass
+        return hit[0]
+    return ADVERSARIAL_RE.search(data) is not None
 
 
 # 3) Rebuff-based attack detector
+REBUFF_CACHE_SIZE = 4096
+
+
 class AttackDetector:
     def __init__(self) -> None:
         self.client: Optional["Rebuff"] = None
@@ -65,56 +162,114 @@ class AttackDetector:
                 self.client = Rebuff()
             except Exception:
                 self.client = None
+        # Rebuff verdicts keyed by input digest, so repeated probes skip the network call
+        self._verdicts: "OrderedDict[bytes, bool]" = OrderedDict()
+        self._verdicts_lock = threading.Lock()
+
+    def _rebuff_classify(self, user_input: str) -> bool:
+        key = hashlib.blake2b(user_input.encode("utf-8"), digest_size=16).digest()
+        with self._verdicts_lock:
+            verdict = self._verdicts.get(key)
+            if verdict is not None:
+                self._verdicts.move_to_end(key)
+                return verdict
 
-    def is_attack(self, user_input: str) -> bool:
+        result = self.client.detect_attack(user_input)
+        verdict = isinstance(result, dict) and bool(result.get("is_attack", False))
+
+        with self._verdicts_lock:
+            self._verdicts[key] = verdict
+            if len(self._verdicts) > REBUFF_CACHE_SIZE:
+                self._verdicts.popitem(last=False)
+        return verdict
+
+    def is_attack(self, q: Query) -> bool:
+        if heuristic_is_adversarial(q):
+            return True
+        # Anything the local scan misses escalates to Rebuff (verdicts are cached by digest)
         if self.client is not None:
             try:
-                result = self.client.detect_attack(user_input)
-                if isinstance(result, dict) and result.get("is_attack", False):
-                    return True
+                return self._rebuff_classify(q.raw)
             except Exception:
                 pass
-        return heuristic_is_adversarial(user_input)
+        return False
+
+
+# One detector (and Rebuff client) per process, shared by every guarded chain
+_GLOBAL_DETECTOR: Optional[AttackDetector] = None
+_GLOBAL_DETECTOR_LOCK = threading.Lock()
 
 
-# 4) Guarded conversational chain with ConversationSummaryMemory
+def get_attack_detector() -> AttackDetector:
+    global _GLOBAL_DETECTOR
+    if _GLOBAL_DETECTOR is None:
+        with _GLOBAL_DETECTOR_LOCK:
+            if _GLOBAL_DETECTOR is None:
+                _GLOBAL_DETECTOR = AttackDetector()
+    return _GLOBAL_DETECTOR
+
+
+# 4) Guarded conversational chain with ConversationSummaryBufferMemory
+# Recent turns stay verbatim; older ones are summarized only once the buffer exceeds the limit
 def build_guarded_chain_with_memory(llm: ChatOpenAI):
-    memory = ConversationSummaryMemory(llm=llm, return_messages=True)
-    detector = AttackDetector()
+    memory = ConversationSummaryBufferMemory(llm=llm, max_token_limit=1500, return_messages=True)
+    detector = get_attack_detector()
 
-    base_chain = ConversationChain(
-        llm=llm,
-        memory=memory,
-        verbose=False
-    )
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", "The following is a friendly conversation between a human and an AI. "
+                   "The AI is talkative and provides lots of specific details from its context. "
+                   "If the AI does not know the answer to a question, it truthfully says it does not know."),
+        MessagesPlaceholder(variable_name="history"),
+        ("human", "{input}"),
+    ])
+    # Plain LCEL pipeline; memory is read and written explicitly around each call
+    base_chain = prompt | llm | StrOutputParser()
 
     def guarded_conversation(question: str):
-        if detector.is_attack(question):
+        q = Query.from_text(question)
+        if detector.is_attack(q):
             return ("⚠️ Your prompt appears to contain adversarial or unsafe instructions. "
                     "For security reasons, I cannot process this request. "
                     "Please rephrase your question in a safe and compliant way.")
 
-        if asks_for_personalized_investment_advice(question):
+        if asks_for_personalized_investment_advice(q):
             return ("I can’t provide personalized investment advice. "
                     "I can explain general financial concepts if you’d like.")
 
-        return base_chain.run(question)
+        history = memory.load_memory_variables({})["history"]
+        answer = base_chain.invoke({"input": question, "history": history})
+        memory.save_context({"input": question}, {"output": answer})
+        return answer
 
     return guarded_conversation
 
 
 # 5) Unsafe investment requests
-def asks_for_personalized_investment_advice(text: str) -> bool:
-    keywords = [
-        "which stock should i buy",
-        "tell me exactly which stock to buy",
-        "invest all my savings",
-        "guaranteed returns",
-        "100% sure",
-        "what should i do with my portfolio",
-    ]
-    text_l = text.lower()
-    return any(kw in text_l for kw in keywords)
+INVESTMENT_KEYWORDS = [
+    "which stock should i buy",
+    "tell me exactly which stock to buy",
+    "invest all my savings",
+    "guaranteed returns",
+    "100% sure",
+    "what should i do with my portfolio",
+]
+
+# Aho-Corasick automaton finds any keyword in one pass over the input
+INVESTMENT_AUTOMATON = None
+if AHOCORASICK_AVAILABLE:
+    INVESTMENT_AUTOMATON = ahocorasick.Automaton()
+    for kw in INVESTMENT_KEYWORDS:
+        INVESTMENT_AUTOMATON.add_word(kw, kw)
+    INVESTMENT_AUTOMATON.make_automaton()
+
+# Single-pass fallback when pyahocorasick is not installed; input is already case-folded
+INVESTMENT_RE = re.compile("|".join(re.escape(kw) for kw in INVESTMENT_KEYWORDS))
+
+
+def asks_for_personalized_investment_advice(q: Query) -> bool:
+    if INVESTMENT_AUTOMATON is not None:
+        return next(INVESTMENT_AUTOMATON.iter(q.folded), None) is not None
+    return INVESTMENT_RE.search(q.folded) is not None
 
 
 def main():
@@ -1,13 +1,22 @@
+import ast
+import asyncio
+import functools
+import operator
 import os
+import threading
+from datetime import date
 from dotenv import load_dotenv
 
+import pyarrow as pa
+
 from langchain_openai import ChatOpenAI
 from langchain_community.utilities import SerpAPIWrapper
 from langchain_community.agent_toolkits import SQLDatabaseToolkit
 from langchain_community.utilities import SQLDatabase
 from langchain_community.tools import Tool
 from langchain.agents import initialize_agent, AgentType
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
 
 
 def init_env():
@@ -31,42 +40,114 @@ def build_llm(groq_api_key: str) -> ChatOpenAI:
     return llm
 
 
-def seed_duckdb(db_path: str = "stocks.duckdb") -> SQLDatabase:
+class CachedSQLDatabase(SQLDatabase):
     """
-    Initialize a DuckDB database with example stock price data.
+    SQLDatabase that memoizes table-info strings; the seeded schema never changes.
     """
-    engine = create_engine(f'duckdb:///{db_path}')
-    conn = engine.connect()
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._table_info_cache = {}
 
-    conn.execute(text("""
-        CREATE TABLE IF NOT EXISTS stock_prices (
-            company TEXT,
-            closing_price DOUBLE,
-            date DATE
-        );
-    """))
+    def get_table_info(self, table_names=None, **kwargs) -> str:
+        key = (tuple(table_names) if table_names is not None else None, tuple(sorted(kwargs.items())))
+        if key not in self._table_info_cache:
+            self._table_info_cache[key] = super().get_table_info(table_names, **kwargs)
+        return self._table_info_cache[key]
 
-    conn.execute(text("DELETE FROM stock_prices;"))
-    conn.execute(text("""
-        INSERT INTO stock_prices VALUES
-        ('Apple', 185.2, '2024-07-01'),
-        ('Apple', 187.1, '2024-07-02'),
-        ('Google', 135.6, '2024-07-01'),
-        ('Google', 137.3, '2024-07-02'),
-        ('NVIDIA', 120.0, '2024-07-01'),
-        ('NVIDIA', 125.5, '2024-07-02')
-    """))
 
-    return SQLDatabase(engine)
+@functools.lru_cache(maxsize=None)
+def get_engine(db_path: str = "stocks.duckdb") -> Engine:
+    """
+    Process-wide DuckDB engine. The default QueuePool hands each checkout its own
+    connection, so concurrent agent tool calls never share one; all connections
+    attach to the same in-process DuckDB instance.
+    """
+    return create_engine(f'duckdb:///{db_path}')
+
+
+@functools.lru_cache(maxsize=None)
+def seed_duckdb(db_path: str = "stocks.duckdb") -> SQLDatabase:
+    """
+    Initialize a DuckDB database with example stock price data.
+    Seeds once per process; repeated calls return the same SQLDatabase.
+    """
+    engine = get_engine(db_path)
+
+    # Columnar seed data, loaded through Arrow instead of SQL literal rows
+    seed_tbl = pa.table({
+        "company": pa.array(["Apple", "Apple", "Google", "Google", "NVIDIA", "NVIDIA"], pa.string()),
+        "closing_price": pa.array([185.2, 187.1, 135.6, 137.3, 120.0, 125.5], pa.float64()),
+        "date": pa.array([date(2024, 7, 1), date(2024, 7, 2)] * 3, pa.date32()),
+    })
+
+    raw_conn = engine.raw_connection()
+    try:
+        duck = raw_conn.driver_connection
+        duck.register("seed_tbl", seed_tbl)
+        duck.execute("CREATE OR REPLACE TABLE stock_prices AS SELECT * FROM seed_tbl")
+        duck.unregister("seed_tbl")
+    finally:
+        raw_conn.close()
+
+    return CachedSQLDatabase(engine)
+
+
+# Bounds on ** so expressions like 9**9**9**9 are rejected instead of exhausting CPU/memory
+_MAX_POW_BASE = 10 ** 6
+_MAX_POW_EXPONENT = 100
+
+
+def _safe_pow(base: float, exponent: float) -> float:
+    if abs(base) > _MAX_POW_BASE or abs(exponent) > _MAX_POW_EXPONENT:
+        raise ValueError(f"Exponentiation too large: {base} ** {exponent}")
+    try:
+        return operator.pow(base, exponent)
+    except OverflowError:
+        raise ValueError(f"Exponentiation too large: {base} ** {exponent}")
+
+
+_BIN_OPS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: _safe_pow,
+}
+
+_UNARY_OPS = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+}
+
+
+def _eval_node(node: ast.AST) -> float:
+    if isinstance(node, ast.Expression):
+        return _eval_node(node.body)
+    if (isinstance(node, ast.Constant) and isinstance(node.value, (int, float))
+            and not isinstance(node.value, bool)):
+        return node.value
+    if isinstance(node, ast.BinOp) and type(node.op) in _BIN_OPS:
+        return _BIN_OPS[type(node.op)](_eval_node(node.left), _eval_node(node.right))
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPS:
+        return _UNARY_OPS[type(node.op)](_eval_node(node.operand))
+    raise ValueError(f"Unsupported expression: {ast.dump(node)}")
+
+
+@functools.lru_cache(maxsize=256)
+def _parse_expr(expr: str) -> ast.Expression:
+    return ast.parse(expr.strip(), mode="eval")
 
 
 def build_calculator_tool() -> Tool:
     """
-    Basic unsafe calculator using eval (demo only).
-    In production, use a secure parser.
+    Arithmetic calculator backed by a small AST evaluator.
+    Only numbers and + - * / // % ** are accepted (** with bounded base and exponent);
+    parsed expressions are cached.
     """
     def _calc(expr: str) -> str:
-        return str(eval(expr, {"__builtins__": {}}, {}))
+        return str(_eval_node(_parse_expr(expr)))
 
     return Tool(
         name="Calculator",
@@ -112,18 +193,39 @@ def build_agent(llm: ChatOpenAI, db: SQLDatabase):
     return agent
 
 
-def demo_queries(agent):
+# Agents keyed by (id(llm), id(db)); each agent references its llm and db,
+# so those ids stay alive and cannot be reused by other objects
+_AGENTS = {}
+_AGENT_LOCK = threading.Lock()
+
+
+def get_agent(llm: ChatOpenAI, db: SQLDatabase):
+    """
+    Build the agent once per (llm, db) pair and reuse it for every later request.
+    """
+    key = (id(llm), id(db))
+    agent = _AGENTS.get(key)
+    if agent is None:
+        with _AGENT_LOCK:
+            agent = _AGENTS.get(key)
+            if agent is None:
+                agent = build_agent(llm, db)
+                _AGENTS[key] = agent
+    return agent
+
+
+async def demo_queries(agent):
     """
-    Demonstration queries for testing the agent.
+    Demonstration queries for testing the agent, run concurrently.
     """
     qs = [
         "What is the percentage change in Apple's closing price between 2024-07-01 and 2024-07-02?",
         "Compare the latest closing prices of Google and NVIDIA. Which one increased more?",
         "Did Apple stock rise in the last two days? If so, by what percentage?"
     ]
-    for q in qs:
+    answers = await asyncio.gather(*(agent.arun(q) for q in qs))
+    for q, ans in zip(qs, answers):
         print(f"\nQ: {q}")
-        ans = agent.run(q)
         print(f"A: {ans}")
 
 
@@ -131,7 +233,7 @@ def main():
     groq_key = init_env()
     llm = build_llm(groq_key)
     db = seed_duckdb()
-    agent = build_agent(llm, db)
+    agent = get_agent(llm, db)
 
     # Run a single query
     answer = agent.run(
@@ -141,7 +243,7 @@ def main():
     print(answer)
 
     # Optional: run multiple demo queries
-    demo_queries(agent)
+    asyncio.run(demo_queries(agent))
 
 
 if __name__ == "__main__":
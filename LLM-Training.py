@@ -4,16 +4,18 @@ from groq import Groq
 client = Groq()
 
 def generate_content(prompt):
-    response = client.chat.completions.create(
+    stream = client.chat.completions.create(
         messages = [{
             "role" : "user",
             "content":prompt
         }],
-        model = "llama-3.1-8b-instant"
+        model = "llama-3.1-8b-instant",
+        stream = True
     )
-    return response
+    for chunk in stream:
+        yield chunk.choices[0].delta.content or ""
 
-output = generate_content("What will be the future oıf AI jobs in next 5 years")
-
-print(output)
+for token in generate_content("What will be the future oıf AI jobs in next 5 years"):
+    print(token, end="", flush=True)
 
+print()